@@ -6,33 +6,119 @@ This module uses Google ADK (Agent Development Kit) framework to create agents t
 - Follow ADK framework patterns
 """
 
-import json
+import copy
+import functools
+import hashlib
 import logging
 import os
-from typing import Any
+from typing import TYPE_CHECKING, Any, AsyncIterator
 
-from dotenv import load_dotenv
-from google.adk.agents import Agent
-from jinja2 import Environment, FileSystemLoader
+import orjson
+from cachetools import TTLCache
+from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader, ModuleLoader
 
-# Load environment variables
-load_dotenv()
+# google.adk, google.generativeai and dotenv are heavy imports; they are loaded
+# on first use so importing this module (and app startup) stays cheap
+if TYPE_CHECKING:
+    from google.adk.agents import Agent
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Get API key (ADK uses GOOGLE_API_KEY)
-GEMINI_API_KEY = os.environ.get("GEMINI_API_KEY") or os.environ.get("GOOGLE_API_KEY")
-if not GEMINI_API_KEY:
-    logger.warning("GEMINI_API_KEY/GOOGLE_API_KEY not set. Agent will use mock responses.")
 
-# Setup Jinja2 for prompt templates
+@functools.cache
+def _api_key() -> str | None:
+    """Load environment variables and return the Gemini API key (ADK uses GOOGLE_API_KEY)."""
+    from dotenv import load_dotenv
+    load_dotenv()
+    
+    api_key = os.environ.get("GEMINI_API_KEY") or os.environ.get("GOOGLE_API_KEY")
+    if not api_key:
+        logger.warning("GEMINI_API_KEY/GOOGLE_API_KEY not set. Agent will use mock responses.")
+    return api_key
+
+
+@functools.cache
+def _genai() -> Any:
+    """Import and configure google.generativeai on first use."""
+    import google.generativeai as genai
+    genai.configure(api_key=_api_key())
+    return genai
+
+PROMPTS_DIR = os.path.join(os.path.dirname(__file__), "prompts")
+# Prompt templates compiled ahead of time to Python modules (see compile_prompts)
+COMPILED_PROMPTS_DIR = os.path.join(os.path.dirname(__file__), "prompts_compiled")
+
+# Persist compiled template bytecode so warm starts skip Jinja's parse/codegen step
+JINJA_CACHE_DIR = os.environ.get("JINJA_CACHE_DIR", "/tmp/prepmate_jinja_cache")
+os.makedirs(JINJA_CACHE_DIR, exist_ok=True)
+
+
+def compile_prompts(target: str = COMPILED_PROMPTS_DIR) -> None:
+    """Compile the prompt templates to importable modules (run at image build time)."""
+    Environment(loader=FileSystemLoader(PROMPTS_DIR), autoescape=False).compile_templates(
+        target, zip=None, ignore_errors=False
+    )
+
+
+# Setup Jinja2 for prompt templates; precompiled modules skip loading and parsing entirely
 prompt_env = Environment(
-    loader=FileSystemLoader(os.path.join(os.path.dirname(__file__), "prompts")),
-    autoescape=False
+    loader=ModuleLoader(COMPILED_PROMPTS_DIR) if os.path.isdir(COMPILED_PROMPTS_DIR) else FileSystemLoader(PROMPTS_DIR),
+    autoescape=False,
+    bytecode_cache=FileSystemBytecodeCache(directory=JINJA_CACHE_DIR, pattern="__jinja2_%s.cache"),
+    auto_reload=False,  # Prompts only change on deploy; skip per-request mtime checks
+    cache_size=400
 )
 
 
+@functools.lru_cache(maxsize=None)
+def _render_static_prompt(name: str) -> str:
+    """Render a variable-free prompt template once per process."""
+    return prompt_env.get_template(name).render()
+
+
+# Mock prep sheet (no API key), compiled once instead of re-formatted per call
+_MOCK_PREP_SHEET_TEMPLATE = prompt_env.from_string("""
+<html>
+<head>
+    <style>
+        body { font-family: Arial, sans-serif; margin: 20px; }
+        h1 { color: #2c3e50; }
+        .section { margin: 20px 0; }
+    </style>
+</head>
+<body>
+    <h1>Doctor Appointment Prep Sheet</h1>
+    <p><em>This is a communication aid, not medical advice.</em></p>
+    
+    <div class="section">
+        <h2>Patient Information</h2>
+        <p><strong>Name:</strong> {{ patient_info.get('name', 'N/A') }}</p>
+        <p><strong>Age:</strong> {{ patient_info.get('age', 'N/A') }}</p>
+        <p><strong>Gender:</strong> {{ patient_info.get('gender', 'N/A') }}</p>
+        <p><strong>Allergies:</strong> {{ patient_info.get('allergies', 'N/A') }}</p>
+        <p><strong>Medications:</strong> {{ patient_info.get('medications', 'N/A') }}</p>
+    </div>
+    
+    <div class="section">
+        <h2>Symptom Summary</h2>
+        <p>{{ summary }}</p>
+    </div>
+</body>
+</html>
+""")
+
+# Gemini results keyed by a hash of their inputs, so retries and repeated
+# submissions with identical inputs skip the round trip
+RESULT_CACHE_TTL = 3600
+_suggest_cache: TTLCache = TTLCache(maxsize=10_000, ttl=RESULT_CACHE_TTL)
+_prep_sheet_cache: TTLCache = TTLCache(maxsize=10_000, ttl=RESULT_CACHE_TTL)
+
+
+def _cache_key(**inputs: Any) -> str:
+    return hashlib.sha256(orjson.dumps(inputs, option=orjson.OPT_SORT_KEYS)).hexdigest()
+
+
 # Firestore tools as functions (ADK uses function tools)
 def create_prep_session(
     session_id: str,
@@ -77,7 +163,7 @@ def create_prep_session(
         )
         return {"status": "success", "session_id": session_id, "message": "Session created in Firestore"}
     except Exception as e:
-        logger.error(f"Failed to create session: {e}")
+        logger.error("Failed to create session: %s", e)
         return {"status": "error", "error": str(e)}
 
 
@@ -108,13 +194,14 @@ def update_prep_session(
         )
         return {"status": "success", "session_id": session_id, "message": "Session updated in Firestore"}
     except Exception as e:
-        logger.error(f"Failed to update session: {e}")
+        logger.error("Failed to update session: %s", e)
         return {"status": "error", "error": str(e)}
 
 
 # Create ADK agents
-def create_suggest_agent() -> Agent:
+def create_suggest_agent() -> "Agent":
     """Create ADK agent for generating symptom summaries and questions."""
+    from google.adk.agents import Agent
     
     instruction = """You are a helpful assistant that helps patients prepare for doctor visits.
 You analyze symptom descriptions and generate:
@@ -134,7 +221,7 @@ You must respond with valid JSON in this exact format:
 }"""
     
     return Agent(
-        model='gemini-2.5-flash',
+        model='gemini-2.5-flash-lite',
         name='suggest_agent',
         description='Generates symptom summaries and follow-up questions for doctor visits',
         instruction=instruction,
@@ -142,8 +229,9 @@ You must respond with valid JSON in this exact format:
     )
 
 
-def create_generate_agent() -> Agent:
+def create_generate_agent() -> "Agent":
     """Create ADK agent for generating final prep sheets."""
+    from google.adk.agents import Agent
     
     instruction = """You are a helpful assistant that creates Doctor Appointment Prep Sheets.
 You generate structured HTML prep sheets with:
@@ -173,14 +261,60 @@ You must respond with valid JSON in this exact format:
     )
 
 
-# Global agent instances
-suggest_agent = create_suggest_agent()
-generate_agent = create_generate_agent()
+# Agent instances, created on first use
+@functools.cache
+def _suggest_agent() -> "Agent":
+    return create_suggest_agent()
+
+
+@functools.cache
+def _generate_agent() -> "Agent":
+    return create_generate_agent()
+
+
+# Gemini models and generation configs, built once and reused across requests.
+# The suggest response is small and bounded (1 sentence + <=5 questions), so it
+# runs on the lighter model with a capped output length.
+SUGGEST_MAX_OUTPUT_TOKENS = 512
+
+
+@functools.cache
+def _generation_config(max_output_tokens: int | None = None) -> Any:
+    return _genai().types.GenerationConfig(
+        temperature=0.3,
+        response_mime_type="application/json",
+        max_output_tokens=max_output_tokens
+    )
+
+
+@functools.cache
+def _suggest_model() -> Any:
+    return _genai().GenerativeModel('gemini-2.5-flash-lite', system_instruction=_suggest_agent().instruction)
+
+
+@functools.cache
+def _generate_model() -> Any:
+    return _genai().GenerativeModel('gemini-2.5-flash', system_instruction=_generate_agent().instruction)
+
+
+async def _generate_json(model: Any, contents: str, generation_config: Any) -> dict:
+    """Stream a JSON-mode completion and parse it once the last chunk arrives.
+    
+    Uses the async client so a pending Gemini call doesn't block the event loop.
+    """
+    stream = await model.generate_content_async(contents, generation_config=generation_config, stream=True)
+    chunks = [chunk.text async for chunk in stream]
+    return orjson.loads("".join(chunks))
 
 
 class PrepMateAgent:
     """Wrapper class for ADK agents to maintain API compatibility."""
     
+    def __init__(self):
+        # Resolve the per-request prompt templates once instead of on every call
+        self.suggest_tpl = prompt_env.get_template("suggest_tail.txt")
+        self.generate_tpl = prompt_env.get_template("generate_tail.txt")
+    
     async def suggest_followups(
         self,
         patient_info: dict,
@@ -189,16 +323,16 @@ class PrepMateAgent:
     ) -> dict:
         """Generate symptom summary and follow-up questions using ADK agent."""
         
-        # Render prompt template
-        template = prompt_env.get_template("suggest.txt")
-        user_prompt = template.render(
-            patient_info=json.dumps(patient_info, ensure_ascii=False),
+        # Render prompt templates (the static prefix is rendered once per process)
+        static_prefix = _render_static_prompt("suggest_prefix.txt")
+        user_tail = self.suggest_tpl.render(
+            patient_info=orjson.dumps(patient_info).decode(),
             symptom_description=symptom_description,
             language=language
         )
         
         # Mock response if no API key
-        if not GEMINI_API_KEY:
+        if not _api_key():
             logger.warning("Using mock response (no API key)")
             return {
                 "summary": "Mock summary: mild headache and nausea for 2 days.",
@@ -209,33 +343,25 @@ class PrepMateAgent:
                 ]
             }
         
+        key = _cache_key(p=patient_info, s=symptom_description, l=language)
+        if key in _suggest_cache:
+            return copy.deepcopy(_suggest_cache[key])
+        
         try:
             # Use direct Gemini API with structured output (ADK integration simplified)
             # ADK's run_async requires InvocationContext which is complex for our use case
-            import google.generativeai as genai
-            genai.configure(api_key=GEMINI_API_KEY)
-            model = genai.GenerativeModel('gemini-2.5-flash')
-            
-            # Use the agent's instruction as system prompt
-            system_instruction = suggest_agent.canonical_instruction if hasattr(suggest_agent, 'canonical_instruction') else ""
-            full_prompt = f"{system_instruction}\n\n{user_prompt}" if system_instruction else user_prompt
-            
-            gemini_response = model.generate_content(
-                full_prompt,
-                generation_config=genai.types.GenerationConfig(
-                    temperature=0.3,
-                    response_mime_type="application/json"
-                )
+            result = await _generate_json(
+                _suggest_model(), f"{static_prefix}\n\n{user_tail}", _generation_config(SUGGEST_MAX_OUTPUT_TOKENS)
             )
-            result = json.loads(gemini_response.text)
             
-            return {
+            _suggest_cache[key] = {
                 "summary": result.get("summary", ""),
                 "questions": result.get("followupQuestions", result.get("questions", []))
             }
+            return copy.deepcopy(_suggest_cache[key])
         
         except Exception as e:
-            logger.error(f"Error in suggest_followups: {e}")
+            logger.error("Error in suggest_followups: %s", e)
             raise
     
     async def generate_prep_sheet(
@@ -247,81 +373,103 @@ class PrepMateAgent:
     ) -> dict:
         """Generate final prep sheet using ADK agent."""
         
-        # Render prompt template
-        template = prompt_env.get_template("generate.txt")
-        user_prompt = template.render(
-            summary=summary,
-            followup_answers=json.dumps(followup_answers, ensure_ascii=False),
-            patient_info=json.dumps(patient_info, ensure_ascii=False),
-            language=language
-        )
-        
         # Mock response if no API key
-        if not GEMINI_API_KEY:
+        if not _api_key():
             logger.warning("Using mock response (no API key)")
-            mock_html = f"""
-            <html>
-            <head>
-                <style>
-                    body {{ font-family: Arial, sans-serif; margin: 20px; }}
-                    h1 {{ color: #2c3e50; }}
-                    .section {{ margin: 20px 0; }}
-                </style>
-            </head>
-            <body>
-                <h1>Doctor Appointment Prep Sheet</h1>
-                <p><em>This is a communication aid, not medical advice.</em></p>
-                
-                <div class="section">
-                    <h2>Patient Information</h2>
-                    <p><strong>Name:</strong> {patient_info.get('name', 'N/A')}</p>
-                    <p><strong>Age:</strong> {patient_info.get('age', 'N/A')}</p>
-                    <p><strong>Gender:</strong> {patient_info.get('gender', 'N/A')}</p>
-                    <p><strong>Allergies:</strong> {patient_info.get('allergies', 'N/A')}</p>
-                    <p><strong>Medications:</strong> {patient_info.get('medications', 'N/A')}</p>
-                </div>
-                
-                <div class="section">
-                    <h2>Symptom Summary</h2>
-                    <p>{summary}</p>
-                </div>
-            </body>
-            </html>
-            """
+            return self._mock_prep_sheet(patient_info, summary)
+        
+        key = _cache_key(s=summary, a=followup_answers, p=patient_info, l=language)
+        if key in _prep_sheet_cache:
+            return dict(_prep_sheet_cache[key])
+        
+        try:
+            model, contents = self._prep_sheet_request(summary, followup_answers, patient_info, language)
+            result = await _generate_json(model, contents, _generation_config())
             
-            return {
-                "prep_sheet_html": mock_html,
-                "prep_sheet_text": "Doctor Appointment Prep Sheet (mock) - review symptoms and questions."
+            _prep_sheet_cache[key] = {
+                "prep_sheet_html": result.get("prep_sheet_html", "<p>No data</p>"),
+                "prep_sheet_text": result.get("prep_sheet_text", "")
             }
+            return dict(_prep_sheet_cache[key])
+        
+        except Exception as e:
+            logger.error("Error in generate_prep_sheet: %s", e)
+            raise
+    
+    async def generate_prep_sheet_stream(
+        self,
+        summary: str,
+        followup_answers: list,
+        patient_info: dict,
+        language: str
+    ) -> AsyncIterator[str]:
+        """Stream the prep sheet JSON text from Gemini as it is generated.
+        
+        Concatenated, the yielded chunks form a JSON object with prep_sheet_html
+        and prep_sheet_text.
+        """
+        
+        # Mock response if no API key
+        if not _api_key():
+            logger.warning("Using mock response (no API key)")
+            yield orjson.dumps(self._mock_prep_sheet(patient_info, summary)).decode()
+            return
+        
+        key = _cache_key(s=summary, a=followup_answers, p=patient_info, l=language)
+        if key in _prep_sheet_cache:
+            yield orjson.dumps(_prep_sheet_cache[key]).decode()
+            return
         
         try:
-            # Use direct Gemini API with structured output (ADK integration simplified)
-            # ADK's run_async requires InvocationContext which is complex for our use case
-            import google.generativeai as genai
-            genai.configure(api_key=GEMINI_API_KEY)
-            model = genai.GenerativeModel('gemini-2.5-flash')
-            
-            # Use the agent's instruction as system prompt
-            system_instruction = generate_agent.canonical_instruction if hasattr(generate_agent, 'canonical_instruction') else ""
-            full_prompt = f"{system_instruction}\n\n{user_prompt}" if system_instruction else user_prompt
-            
-            gemini_response = model.generate_content(
-                full_prompt,
-                generation_config=genai.types.GenerationConfig(
-                    temperature=0.3,
-                    response_mime_type="application/json"
-                )
+            model, contents = self._prep_sheet_request(summary, followup_answers, patient_info, language)
+            stream = await model.generate_content_async(
+                contents, generation_config=_generation_config(), stream=True
             )
-            result = json.loads(gemini_response.text)
+            chunks = []
+            async for chunk in stream:
+                chunks.append(chunk.text)
+                yield chunk.text
             
-            return {
+            # Cache the assembled result like generate_prep_sheet, so repeats of this
+            # request (streamed or not) skip Gemini
+            result = orjson.loads("".join(chunks))
+            _prep_sheet_cache[key] = {
                 "prep_sheet_html": result.get("prep_sheet_html", "<p>No data</p>"),
                 "prep_sheet_text": result.get("prep_sheet_text", "")
             }
         
         except Exception as e:
-            logger.error(f"Error in generate_prep_sheet: {e}")
+            logger.error("Error in generate_prep_sheet_stream: %s", e)
             raise
+    
+    def _prep_sheet_request(
+        self,
+        summary: str,
+        followup_answers: list,
+        patient_info: dict,
+        language: str
+    ) -> tuple[Any, str]:
+        """Return the model and prompt contents for a prep sheet call."""
+        
+        # Render prompt templates (the static prefix is rendered once per process)
+        static_prefix = _render_static_prompt("generate_prefix.txt")
+        user_tail = self.generate_tpl.render(
+            summary=summary,
+            followup_answers=orjson.dumps(followup_answers).decode(),
+            patient_info=orjson.dumps(patient_info).decode(),
+            language=language
+        )
+        
+        # Use direct Gemini API with structured output (ADK integration simplified)
+        # ADK's run_async requires InvocationContext which is complex for our use case
+        return _generate_model(), f"{static_prefix}\n\n{user_tail}"
+    
+    @staticmethod
+    def _mock_prep_sheet(patient_info: dict, summary: str) -> dict:
+        return {
+            "prep_sheet_html": _MOCK_PREP_SHEET_TEMPLATE.render(patient_info=patient_info, summary=summary),
+            "prep_sheet_text": "Doctor Appointment Prep Sheet (mock) - review symptoms and questions."
+        }
 
 
 # Global agent instance (for backward compatibility)
@@ -5,18 +5,22 @@ This backend provides REST API endpoints that use:
 - MCP Server for Firestore operations
 """
 
+import asyncio
 import base64
-import json
 import logging
+import multiprocessing
 import os
 import uuid
-from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
 from typing import Optional
 
+import orjson
+from cachetools import TTLCache
 from dotenv import load_dotenv
 from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import ORJSONResponse, Response, StreamingResponse
 from fastapi.exceptions import RequestValidationError
 from pydantic import BaseModel, Field
 
@@ -34,7 +38,8 @@ logger = logging.getLogger(__name__)
 app = FastAPI(
     title="PrepMate API",
     description="AI-powered doctor visit preparation assistant",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=ORJSONResponse
 )
 
 # CORS middleware for frontend
@@ -49,9 +54,84 @@ app.add_middleware(
 # Environment variables
 GCS_BUCKET = os.environ.get("GCS_BUCKET_NAME")
 
+# RFC 3339 UTC timestamp format for stored documents
+TIMESTAMP_FORMAT = "%Y-%m-%dT%H:%M:%S.%fZ"
+
 # Get agent instance
 agent = get_agent()
 
+class _DraftCache(TTLCache):
+    """TTLCache of (inputs, task) pairs that cancels a draft's task when it is evicted or expires."""
+    
+    def popitem(self):
+        key, (inputs, task) = super().popitem()
+        task.cancel()
+        return key, (inputs, task)
+    
+    def expire(self, time=None):
+        expired = super().expire(time)
+        for _, (_, task) in expired:
+            task.cancel()
+        return expired
+
+
+# Draft prep sheets started by /session, keyed by session_id and consumed by /generate,
+# each stored with the (summary, patient_info, language) it was built from
+MAX_DRAFTS = 1000
+DRAFT_TTL = 3600
+_draft_prep_sheets: _DraftCache = _DraftCache(maxsize=MAX_DRAFTS, ttl=DRAFT_TTL)
+
+# Inputs and summary from /suggest, keyed by session_id, so /generate only needs the deltas
+_session_contexts: TTLCache = TTLCache(maxsize=10_000, ttl=3600)
+
+# PDF uploads still running after /generate responded; held so they aren't garbage collected
+_pending_uploads: set[asyncio.Task] = set()
+
+# Rendered PDFs served by /sessions/{session_id}/pdf. The endpoint has no ownership
+# check, so it only serves this short window; after that, use a signed URL
+_rendered_pdfs: TTLCache = TTLCache(maxsize=256, ttl=900)
+
+
+@app.on_event("startup")
+async def warmup_firestore():
+    """Establish the Firestore connection so the first request doesn't pay for it."""
+    await asyncio.to_thread(db.warmup)
+
+
+@app.on_event("startup")
+def start_pdf_pool():
+    """Start the process pool that renders PDFs off the event loop."""
+    # Spawn rather than fork: forking after gRPC threads have started can deadlock
+    workers = os.cpu_count() or 1
+    app.state.pdf_pool = ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=pdf.warmup
+    )
+    # Workers start on demand; submit a no-op per worker so they all start now (the
+    # initializer warms each one up) rather than on the first /generate requests
+    for _ in range(workers):
+        app.state.pdf_pool.submit(os.getpid)
+
+
+@app.on_event("shutdown")
+async def finish_pdf_uploads():
+    """Let in-flight PDF uploads (and their pdf_path writes) finish before flushing."""
+    if _pending_uploads:
+        await asyncio.gather(*_pending_uploads, return_exceptions=True)
+
+
+@app.on_event("shutdown")
+def flush_pending_writes():
+    """Send any Firestore writes still buffered in the bulk writer."""
+    db.flush()
+
+
+@app.on_event("shutdown")
+def stop_pdf_pool():
+    """Stop the PDF worker processes."""
+    app.state.pdf_pool.shutdown(cancel_futures=True)
+
 
 # Exception handler for validation errors
 @app.exception_handler(RequestValidationError)
@@ -65,8 +145,8 @@ async def validation_exception_handler(request: Request, exc: RequestValidationE
             "message": error["msg"],
             "type": error["type"]
         })
-    logger.error(f"Validation error: {error_details}")
-    return JSONResponse(
+    logger.error("Validation error: %s", error_details)
+    return ORJSONResponse(
         status_code=422,
         content={
             "detail": "Validation error",
@@ -107,8 +187,9 @@ class FollowupAnswer(BaseModel):
 
 class GenerateRequest(BaseModel):
     session_id: str
-    patient_info: PatientInfo
-    summary: str
+    # Omitted fields are taken from the session's /suggest call (see resolve_session_context)
+    patient_info: Optional[PatientInfo] = None
+    summary: Optional[str] = None
     answers: list[FollowupAnswer]
     language: str = "en"
     consent: bool = False
@@ -122,6 +203,85 @@ class GenerateResponse(BaseModel):
     pdf_base64: Optional[str] = None
 
 
+async def render_pdf(prep_html: str) -> Optional[bytes]:
+    """Render the prep sheet PDF in the process pool, or return None if generation fails."""
+    try:
+        return await asyncio.get_running_loop().run_in_executor(
+            app.state.pdf_pool, pdf.html_to_pdf_bytes, prep_html
+        )
+    except Exception as exc:
+        logger.warning("PDF generation failed: %s", exc)
+        return None
+
+
+def resolve_session_context(request: GenerateRequest) -> GenerateRequest:
+    """Fill in patient_info and summary omitted from a /generate request.
+    
+    The stored language is used too, unless the request set one. Requests that
+    send both patient_info and summary never need the context. Raises 409 if a
+    field was omitted but this instance has no context for the session (expired,
+    restarted, or /suggest served elsewhere); the client should resend it.
+    """
+    missing = [field for field in ("patient_info", "summary") if getattr(request, field) is None]
+    if not missing:
+        return request
+    context = _session_contexts.get(request.session_id)
+    if context is None:
+        raise HTTPException(
+            status_code=409,
+            detail="Session context not found; resend patient_info, summary and language"
+        )
+    if "language" not in request.__fields_set__:
+        missing.append("language")
+    return request.copy(update={field: context[field] for field in missing})
+
+
+def pdf_blob_name(session_id: str) -> str:
+    """GCS object name for a session's PDF."""
+    return f"prep-sheets/{session_id}.pdf"
+
+
+def upload_pdf(pdf_bytes: bytes, session_id: str) -> Optional[str]:
+    """Upload the PDF to GCS if a bucket is configured and return its gs:// path."""
+    if not GCS_BUCKET:
+        return None
+    try:
+        return storage.upload_pdf(GCS_BUCKET, pdf_blob_name(session_id), pdf_bytes)
+    except Exception as exc:
+        logger.warning("PDF upload failed: %s", exc)
+        return None
+
+
+def sign_pdf(pdf_path: str) -> Optional[str]:
+    """Return a signed URL for an uploaded PDF, or None if signing fails."""
+    try:
+        return storage.signed_url(pdf_path)
+    except Exception as exc:
+        logger.warning("PDF URL signing failed: %s", exc)
+        return None
+
+
+async def persist_pdf(pdf_bytes: bytes, session_id: str, db_task: Optional[asyncio.Task]) -> Optional[str]:
+    """Upload the PDF and, once the session write is done, record its gs:// path in Firestore."""
+    pdf_path = await asyncio.to_thread(upload_pdf, pdf_bytes, session_id)
+    if db_task is not None and pdf_path:
+        await db_task
+        await asyncio.to_thread(db.set_pdf_path, session_id, pdf_path)
+    return pdf_path
+
+
+def _upload_done(task: asyncio.Task) -> None:
+    """Forget a finished background upload, logging it if it failed."""
+    _pending_uploads.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        logger.warning("Background PDF upload failed: %s", task.exception())
+
+
+def encode_pdf(pdf_bytes: bytes) -> str:
+    """Base64-encode the PDF for the JSON response."""
+    return base64.b64encode(pdf_bytes).decode("utf-8")
+
+
 @app.get("/health")
 async def health_check():
     """Health check endpoint."""
@@ -144,7 +304,6 @@ async def suggest_followups(request: SuggestRequest):
     
     # Generate session ID
     session_id = request.session_id or str(uuid.uuid4())
-    created_at = datetime.utcnow().isoformat() + "Z"
     
     try:
         # Call ADK Agent to generate summary and questions
@@ -156,10 +315,17 @@ async def suggest_followups(request: SuggestRequest):
         
         summary = result.get("summary", "")
         questions = result.get("questions", [])
+        _session_contexts[session_id] = {
+            "patient_info": request.patient_info,
+            "summary": summary,
+            "language": request.language
+        }
         
         # Store in Firestore via MCP if consent given
         if request.consent:
-            db.create_session(
+            created_at = datetime.now(timezone.utc).strftime(TIMESTAMP_FORMAT)
+            await asyncio.to_thread(
+                db.create_session,
                 doc_id=session_id,  # Fixed: was session_id, should be doc_id
                 document={
                     "id": session_id,
@@ -172,6 +338,8 @@ async def suggest_followups(request: SuggestRequest):
                         "questions": questions,
                         "answers": []
                     },
+                    "num_questions": len(questions),
+                    "num_answers": 0,
                     "consentToStore": True
                 }
             )
@@ -186,82 +354,192 @@ async def suggest_followups(request: SuggestRequest):
         raise HTTPException(status_code=500, detail=f"Error generating suggestions: {str(e)}")
 
 
+@app.post("/session", response_model=SuggestResponse)
+async def start_session(request: SuggestRequest):
+    """Generate summary and questions, then start drafting the prep sheet.
+    
+    Same as /suggest, but also kicks off generate_prep_sheet with no answers in
+    the background while the user reviews the questions. A later /generate call
+    with an empty answers list returns this draft instead of calling Gemini again.
+    """
+    response = await suggest_followups(request)
+    
+    draft = asyncio.create_task(agent.generate_prep_sheet(
+        summary=response.summary,
+        followup_answers=[],
+        patient_info=request.patient_info.dict(),
+        language=request.language
+    ))
+    # Mark failures as retrieved so unused drafts don't log "exception never retrieved"
+    draft.add_done_callback(lambda task: task.cancelled() or task.exception())
+    
+    replaced = _draft_prep_sheets.pop(response.session_id, None)
+    if replaced is not None:
+        replaced[1].cancel()
+    _draft_prep_sheets[response.session_id] = ((response.summary, request.patient_info, request.language), draft)
+    
+    return response
+
+
 @app.post("/generate", response_model=GenerateResponse)
-async def generate_prep_sheet(request: GenerateRequest):
+async def generate_prep_sheet(request: GenerateRequest, inline: bool = False, signed_url: bool = False):
     """Generate final prep sheet with HTML and PDF.
     
     This endpoint:
     1. Takes summary, answers, and patient info
     2. Calls ADK Agent with Gemini to generate final prep sheet
-    3. Generates PDF using pdfkit
+    3. Generates PDF using WeasyPrint
     4. Optionally uploads to GCS and updates Firestore via MCP
+    
+    The PDF itself is served by /sessions/{session_id}/pdf and uploaded to GCS
+    after the response is sent; pass `?signed_url=true` to wait for the upload
+    and get a signed `pdf_url`, or `?inline=true` to also get the bytes as
+    `pdf_base64`.
     """
     
     # Log incoming request for debugging
-    logger.info(f"Generate request received: session_id={request.session_id}, answers_count={len(request.answers)}")
+    logger.info("Generate request received: session_id=%s, answers_count=%s", request.session_id, len(request.answers))
     
     # Validate inputs
+    request = resolve_session_context(request)
     if not request.summary.strip():
         raise HTTPException(status_code=400, detail="summary is required")
     
-    # Validate answers
-    if not request.answers:
+    # Validate answers (empty is allowed when /session already drafted the sheet)
+    drafted = _draft_prep_sheets.pop(request.session_id, None)
+    if not request.answers and drafted is None:
         raise HTTPException(status_code=400, detail="answers list cannot be empty")
     
+    # Only reuse the draft if it was built from these exact inputs
+    draft = None
+    if drafted is not None:
+        draft_inputs, draft = drafted
+        if request.answers or draft_inputs != (request.summary, request.patient_info, request.language):
+            draft.cancel()
+            draft = None
+    
     try:
-        # Call ADK Agent to generate prep sheet
-        result = await agent.generate_prep_sheet(
-            summary=request.summary,
-            followup_answers=[answer.dict() for answer in request.answers],
-            patient_info=request.patient_info.dict(),
-            language=request.language
-        )
+        if draft is None:
+            # Call ADK Agent to generate prep sheet
+            result = await agent.generate_prep_sheet(
+                summary=request.summary,
+                followup_answers=[answer.dict() for answer in request.answers],
+                patient_info=request.patient_info.dict(),
+                language=request.language
+            )
+        else:
+            result = await draft
         
         prep_html = result.get("prep_sheet_html", "<p>No data</p>")
         prep_text = result.get("prep_sheet_text", "")
         
-        # Generate PDF
-        pdf_bytes = None
-        pdf_url = None
-        try:
-            pdf_bytes = pdf.html_to_pdf_bytes(prep_html)
-            
-            # Upload to GCS if bucket configured
-            if GCS_BUCKET and pdf_bytes:
-                pdf_url = storage.upload_pdf(
-                    GCS_BUCKET, 
-                    f"prep-sheets/{request.session_id}.pdf", 
-                    pdf_bytes
-                )
-        except Exception as exc:
-            logger.warning(f"PDF generation failed: {exc}")
-        
-        # Update Firestore via MCP if consent given
+        # Update Firestore via MCP (if consent given) while the PDF is rendered and
+        # uploaded; only the final pdf_path write has to wait for both
+        db_task = None
         if request.consent:
-            db.update_session_answers(
+            db_task = asyncio.create_task(asyncio.to_thread(
+                db.update_session_answers,
                 session_id=request.session_id,
                 answers=[answer.dict() for answer in request.answers],
                 final_html=prep_html,
-                pdf_url=pdf_url
-            )
+                pdf_url=None
+            ))
         
-        # Prepare response
-        response = GenerateResponse(
-            session_id=request.session_id,
-            prep_sheet_html=prep_html,
-            prep_sheet_text=prep_text,
-            pdf_url=pdf_url
-        )
+        pdf_bytes = await render_pdf(prep_html)
         
+        # Keep the PDF for /sessions/{session_id}/pdf and upload it to GCS in the
+        # background; only wait for the signed URL or inline the bytes if asked to
+        pdf_url = None
+        pdf_base64 = None
         if pdf_bytes:
-            response.pdf_base64 = base64.b64encode(pdf_bytes).decode("utf-8")
+            _rendered_pdfs[request.session_id] = pdf_bytes
+            upload = asyncio.create_task(persist_pdf(pdf_bytes, request.session_id, db_task))
+            _pending_uploads.add(upload)
+            upload.add_done_callback(_upload_done)
+            if inline:
+                pdf_base64 = await asyncio.to_thread(encode_pdf, pdf_bytes)
+            if signed_url:
+                pdf_path = await upload
+                if pdf_path:
+                    pdf_url = await asyncio.to_thread(sign_pdf, pdf_path)
+        
+        if db_task is not None:
+            await db_task
         
-        return response
+        # Return the response directly; GenerateResponse only documents the schema,
+        # re-validating these server-built fields (HTML, base64 PDF) is wasted work
+        return ORJSONResponse({
+            "session_id": request.session_id,
+            "prep_sheet_html": prep_html,
+            "prep_sheet_text": prep_text,
+            "pdf_url": pdf_url,
+            "pdf_base64": pdf_base64
+        })
     
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error generating prep sheet: {str(e)}")
 
 
+@app.get("/sessions/{session_id}/pdf")
+async def get_session_pdf(session_id: str):
+    """Return the prep sheet PDF rendered for a session in the last 15 minutes as raw bytes.
+    
+    Older PDFs are not read back from GCS: anyone who knows a session_id could
+    fetch them. Use the signed `pdf_url` from `/generate?signed_url=true` instead.
+    """
+    pdf_bytes = _rendered_pdfs.get(session_id)
+    if pdf_bytes is None:
+        raise HTTPException(status_code=404, detail="PDF not found or expired")
+    
+    return Response(
+        content=pdf_bytes,
+        media_type="application/pdf",
+        headers={"Content-Disposition": f'attachment; filename="prep_{session_id}.pdf"'}
+    )
+
+
+@app.post("/generate/stream")
+async def generate_prep_sheet_stream(request: GenerateRequest):
+    """Stream the prep sheet as Server-Sent Events while Gemini generates it.
+    
+    Each event is `data: {"delta": "<text>"}` carrying the next chunk of the
+    JSON response; the last is `data: {"done": true, "prep_sheet_html": ...,
+    "prep_sheet_text": ...}`. Failures are sent as an `error` event. PDF
+    generation and Firestore persistence remain on /generate.
+    """
+    
+    # Validate inputs
+    request = resolve_session_context(request)
+    if not request.summary.strip():
+        raise HTTPException(status_code=400, detail="summary is required")
+    if not request.answers:
+        raise HTTPException(status_code=400, detail="answers list cannot be empty")
+    
+    async def events():
+        chunks = []
+        try:
+            async for text in agent.generate_prep_sheet_stream(
+                summary=request.summary,
+                followup_answers=[answer.dict() for answer in request.answers],
+                patient_info=request.patient_info.dict(),
+                language=request.language
+            ):
+                chunks.append(text)
+                yield b"data: " + orjson.dumps({"delta": text}) + b"\n\n"
+            
+            result = orjson.loads("".join(chunks))
+            yield b"data: " + orjson.dumps({
+                "done": True,
+                "prep_sheet_html": result.get("prep_sheet_html", "<p>No data</p>"),
+                "prep_sheet_text": result.get("prep_sheet_text", "")
+            }) + b"\n\n"
+        except Exception as e:
+            logger.error("Error streaming prep sheet: %s", e)
+            yield b"event: error\ndata: " + orjson.dumps({"detail": f"Error generating prep sheet: {e}"}) + b"\n\n"
+    
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+
 @app.get("/")
 async def root():
     """Root endpoint with API info."""
@@ -271,7 +549,10 @@ async def root():
         "endpoints": {
             "health": "/health",
             "suggest": "/suggest",
-            "generate": "/generate"
+            "session": "/session",
+            "generate": "/generate",
+            "session_pdf": "/sessions/{session_id}/pdf",
+            "generate_stream": "/generate/stream"
         },
         "architecture": {
             "framework": "FastAPI",
@@ -286,4 +567,11 @@ async def root():
 if __name__ == "__main__":
     import uvicorn
     port = int(os.environ.get("PORT", "8080"))
-    uvicorn.run(app, host="0.0.0.0", port=port)
+    uvicorn.run(
+        "app:app",
+        host="0.0.0.0",
+        port=port,
+        loop="uvloop",
+        http="httptools",
+        workers=int(os.environ.get("WORKERS", "1"))
+    )
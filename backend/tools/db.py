@@ -3,64 +3,225 @@
 from __future__ import annotations
 
 import logging
+import os
+import threading
+import time
 from typing import Any
 
+import zstandard
+
 try:
     from google.cloud import firestore  # type: ignore
+    from google.cloud.firestore_v1.bulk_writer import BulkWriterOptions  # type: ignore
 except Exception:  # pragma: no cover - optional dependency
     firestore = None
 
 _CLIENT = None
+_CLIENT_LOCK = threading.Lock()
+_BULK_WRITER = None
+_BULK_LOCK = threading.Lock()
+_FLUSH_LOCK = threading.Lock()
+_FLUSHER = None
+
+# Buffered writes are sent at least this often (seconds)
+FLUSH_INTERVAL = float(os.environ.get("FIRESTORE_FLUSH_INTERVAL", "0.5"))
+BULK_INITIAL_OPS_PER_SECOND = 500
+BULK_MAX_ATTEMPTS = 10
+
+# Prep sheet HTML is stored zstd-compressed in final_output_html_zstd (schema_version 2)
+SCHEMA_VERSION = 2
+HTML_ZSTD_LEVEL = 6
 
+# Fields needed to list sessions; skips the large summary and follow-up payloads
+SESSION_SUMMARY_FIELDS = ["id", "patient_info.name", "created_at", "consentToStore", "num_questions", "num_answers"]
 
-def _client():
+
+def get_client():
+    """Return the process-wide Firestore client, creating it on first use."""
     global _CLIENT
     if _CLIENT is None:
-        if firestore is None:
-            raise RuntimeError("google-cloud-firestore is not installed.")
-        _CLIENT = firestore.Client()
+        with _CLIENT_LOCK:
+            if _CLIENT is None:
+                if firestore is None:
+                    raise RuntimeError("google-cloud-firestore is not installed.")
+                _CLIENT = firestore.Client()
     return _CLIENT
 
 
+def _buffer_set(doc_ref, document: dict[str, Any], merge: bool = False) -> None:
+    """Buffer a set() on the current BulkWriter, starting the background flusher on first use.
+    
+    BulkWriter.flush() shuts the writer's executor down for good, so each flush
+    takes the current writer and the next write starts a fresh one.
+    """
+    global _BULK_WRITER, _FLUSHER
+    with _BULK_LOCK:
+        if _BULK_WRITER is None:
+            _BULK_WRITER = get_client().bulk_writer(
+                options=BulkWriterOptions(initial_ops_per_second=BULK_INITIAL_OPS_PER_SECOND)
+            )
+            _BULK_WRITER.on_write_error(_retry_write)
+        if _FLUSHER is None:
+            _FLUSHER = threading.Thread(target=_flush_loop, name="firestore-flush", daemon=True)
+            _FLUSHER.start()
+        _BULK_WRITER.set(doc_ref, document, merge=merge)
+
+
+def _retry_write(failure, bulk_writer) -> bool:
+    """Retry failed writes (with the writer's backoff) up to BULK_MAX_ATTEMPTS."""
+    if failure.attempts < BULK_MAX_ATTEMPTS:
+        return True
+    logging.warning("Giving up on Firestore write after %s attempts: %s", failure.attempts, failure.message)
+    return False
+
+
+def _flush_loop() -> None:
+    while True:
+        time.sleep(FLUSH_INTERVAL)
+        try:
+            flush()
+        except Exception as exc:  # pragma: no cover
+            logging.warning("Failed to flush Firestore writes: %s", exc)
+
+
+def flush() -> None:
+    """Send any buffered writes and wait for them to complete."""
+    global _BULK_WRITER
+    # One flush at a time, so writes to the same document are sent in order
+    with _FLUSH_LOCK:
+        with _BULK_LOCK:
+            writer, _BULK_WRITER = _BULK_WRITER, None
+        if writer is not None:
+            writer.flush()
+
+
+def compress_html(html: str) -> bytes:
+    """Compress prep sheet HTML for storage in final_output_html_zstd."""
+    return zstandard.compress(html.encode("utf-8"), HTML_ZSTD_LEVEL)
+
+
+def _decode_session(data: dict[str, Any]) -> dict[str, Any]:
+    """Restore final_output_html from its compressed field, and num_answers if it was dropped."""
+    compressed = data.pop("final_output_html_zstd", None)
+    if compressed is not None:
+        data["final_output_html"] = zstandard.decompress(compressed).decode("utf-8")
+    # Appends (update_prep_session with append) remove num_answers; count the answers instead
+    answers = (data.get("followup_data") or {}).get("answers")
+    if "num_answers" not in data and answers is not None:
+        data["num_answers"] = len(answers)
+    return data
+
+
+def warmup() -> None:
+    """Open the Firestore channel ahead of the first request."""
+    try:
+        get_client().collection("prep_sessions").limit(1).get()
+    except Exception as exc:  # pragma: no cover
+        logging.warning("Failed to warm up Firestore client: %s", exc)
+
+
 def create_session(doc_id: str, document: dict[str, Any]) -> None:
     """Create a prep session document."""
     try:
-        _client().collection("prep_sessions").document(doc_id).set(document)
+        doc_ref = get_client().collection("prep_sessions").document(doc_id)
+        _buffer_set(doc_ref, document)
     except Exception as exc:  # pragma: no cover
         logging.warning("Failed to create Firestore session: %s", exc)
 
 
+def _final_fields(
+    session_id: str, answers: list[dict[str, Any]], final_html: str, pdf_url: str | None
+) -> dict[str, Any]:
+    """Fields written (with merge=True) when a session is finalized."""
+    data = {
+        "id": session_id,
+        "followup_data": {"answers": answers},
+        "num_answers": len(answers),
+        "final_output_html_zstd": compress_html(final_html),
+        "final_output_html": firestore.DELETE_FIELD,
+        "schema_version": SCHEMA_VERSION,
+        "consentToStore": True,
+        "last_updated": firestore.SERVER_TIMESTAMP,
+    }
+    # Leave pdf_url untouched when unknown so this can't clobber one set earlier
+    if pdf_url is not None:
+        data["pdf_url"] = pdf_url
+    return data
+
+
 def update_session_answers(
     session_id: str, answers: list[dict[str, Any]], final_html: str, pdf_url: str | None
 ) -> None:
-    """Update session with answers and final output."""
+    """Update session with answers and final output, creating it if missing."""
     try:
-        doc_ref = _client().collection("prep_sessions").document(session_id)
-        doc = doc_ref.get()
-        
-        if doc.exists:
-            # Document exists, update it
-            doc_ref.update(
-                {
-                    "followup_data.answers": answers,
-                    "final_output_html": final_html,
-                    "pdf_url": pdf_url,
-                }
-            )
-        else:
-            # Document doesn't exist, create it with minimal data
-            logging.warning(f"Session {session_id} not found, creating new document")
-            doc_ref.set(
-                {
-                    "id": session_id,
-                    "followup_data": {"answers": answers},
-                    "final_output_html": final_html,
-                    "pdf_url": pdf_url,
-                    "consentToStore": True,
-                },
-                merge=True
-            )
+        doc_ref = get_client().collection("prep_sessions").document(session_id)
+        # merge=True is create-or-update and merges nested maps, so no read is needed
+        _buffer_set(doc_ref, _final_fields(session_id, answers, final_html, pdf_url), merge=True)
     except Exception as exc:  # pragma: no cover
         logging.warning("Failed to update Firestore session: %s", exc)
 
 
+def write_session_and_answers(
+    doc_id: str,
+    document: dict[str, Any],
+    answers: list[dict[str, Any]],
+    final_html: str,
+    pdf_url: str | None = None,
+) -> None:
+    """Create a session and finalize it in a single atomic commit.
+    
+    Unlike the buffered helpers above, this commits immediately and raises on failure.
+    """
+    doc_ref = get_client().collection("prep_sessions").document(doc_id)
+    batch = get_client().batch()
+    batch.set(doc_ref, document)
+    batch.set(doc_ref, _final_fields(doc_id, answers, final_html, pdf_url), merge=True)
+    batch.commit()
+
+
+def get_many(session_ids: list[str], fields: list[str] | None = None) -> list[dict[str, Any]]:
+    """Fetch several sessions in a single BatchGetDocuments call.
+    
+    Pass `fields` to return only those field paths. Missing sessions are skipped.
+    """
+    try:
+        collection = get_client().collection("prep_sessions")
+        snapshots = get_client().get_all(
+            [collection.document(session_id) for session_id in session_ids],
+            field_paths=fields
+        )
+        return [_decode_session(snapshot.to_dict()) for snapshot in snapshots if snapshot.exists]
+    except Exception as exc:  # pragma: no cover
+        logging.warning("Failed to fetch Firestore sessions: %s", exc)
+        return []
+
+
+def list_sessions(
+    fields: list[str] = SESSION_SUMMARY_FIELDS, page_size: int | None = None, start_after: str | None = None
+) -> list[dict[str, Any]]:
+    """List sessions, fetching only the given field paths.
+    
+    With `page_size`, returns one page ordered by document ID; pass the last
+    returned `id` as `start_after` to get the next page. Unlike an offset, the
+    cursor doesn't bill reads for the documents it skips.
+    """
+    try:
+        collection = get_client().collection("prep_sessions")
+        query = collection.select(fields)
+        if page_size is not None:
+            query = query.order_by("__name__").limit(page_size)
+            if start_after is not None:
+                query = query.start_after({"__name__": collection.document(start_after)})
+        return [_decode_session(snapshot.to_dict()) for snapshot in query.stream()]
+    except Exception as exc:  # pragma: no cover
+        logging.warning("Failed to list Firestore sessions: %s", exc)
+        return []
+
+
+def set_pdf_path(session_id: str, pdf_path: str) -> None:
+    """Attach the uploaded PDF's gs:// path to a session (signed URLs expire, so they aren't stored)."""
+    try:
+        doc_ref = get_client().collection("prep_sessions").document(session_id)
+        _buffer_set(doc_ref, {"pdf_path": pdf_path, "last_updated": firestore.SERVER_TIMESTAMP}, merge=True)
+    except Exception as exc:  # pragma: no cover
+        logging.warning("Failed to set Firestore session PDF path: %s", exc)
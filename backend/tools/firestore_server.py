@@ -3,114 +3,208 @@
 This MCP server exposes tools for creating and updating PrepMate sessions in Firestore.
 """
 
-import json
 import logging
 from typing import Any
 
+import orjson
 from google.cloud import firestore
 from mcp.server import Server
 from mcp.types import Tool, TextContent
 
+from .db import SCHEMA_VERSION, compress_html, get_client, write_session_and_answers
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Initialize Firestore client
+# Share the backend's Firestore client (and its gRPC channel)
 try:
-    db = firestore.Client()
+    db = get_client()
     logger.info("Firestore client initialized successfully")
 except Exception as e:
-    logger.error(f"Failed to initialize Firestore: {e}")
+    logger.error("Failed to initialize Firestore: %s", e)
     db = None
 
 
 # Create MCP server instance
 mcp_server = Server("firestore-prepmate")
 
+# Firestore commit limits: 500 writes per batch, 10 MiB per request (keep headroom)
+BATCH_MAX_WRITES = 500
+BATCH_MAX_BYTES = 9 * 1024 * 1024
 
-@mcp_server.list_tools()
-async def list_tools() -> list[Tool]:
-    """List available Firestore tools."""
-    return [
-        Tool(
-            name="create_prep_session",
-            description="Create a new prep session document in Firestore with initial patient info, symptom summary, and follow-up questions",
-            inputSchema={
+
+def _session_document(arguments: dict[str, Any]) -> dict[str, Any]:
+    """Build a new prep session document from create_prep_session arguments."""
+    return {
+        "id": arguments["session_id"],
+        "created_at": arguments["created_at"],
+        "initial_input_text": arguments["initial_input_text"],
+        "ai_summary": arguments["ai_summary"],
+        "followup_data": {
+            "questions": arguments["followup_questions"],
+            "answers": []
+        },
+        "patient_info": arguments["patient_info"],
+        "language_code": arguments["language_code"],
+        "consentToStore": True
+    }
+
+
+def _bulk_create(sessions: list[dict[str, Any]]) -> int:
+    """Create sessions in as few batch commits as the Firestore limits allow."""
+    batch, writes, size = db.batch(), 0, 0
+    for arguments in sessions:
+        doc_data = _session_document(arguments)
+        doc_size = len(orjson.dumps(doc_data))
+        if writes and (writes >= BATCH_MAX_WRITES or size + doc_size > BATCH_MAX_BYTES):
+            batch.commit()
+            batch, writes, size = db.batch(), 0, 0
+        batch.set(db.collection("prep_sessions").document(arguments["session_id"]), doc_data)
+        writes += 1
+        size += doc_size
+    if writes:
+        batch.commit()
+    return len(sessions)
+
+
+CREATE_SESSION_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "session_id": {
+            "type": "string",
+            "description": "Unique session ID (UUID)"
+        },
+        "created_at": {
+            "type": "string",
+            "description": "ISO 8601 timestamp"
+        },
+        "initial_input_text": {
+            "type": "string",
+            "description": "User's original symptom description"
+        },
+        "ai_summary": {
+            "type": "string",
+            "description": "AI-generated symptom summary"
+        },
+        "followup_questions": {
+            "type": "array",
+            "description": "List of follow-up questions",
+            "items": {
                 "type": "object",
                 "properties": {
-                    "session_id": {
-                        "type": "string",
-                        "description": "Unique session ID (UUID)"
-                    },
-                    "created_at": {
-                        "type": "string",
-                        "description": "ISO 8601 timestamp"
-                    },
-                    "initial_input_text": {
-                        "type": "string",
-                        "description": "User's original symptom description"
-                    },
-                    "ai_summary": {
-                        "type": "string",
-                        "description": "AI-generated symptom summary"
-                    },
-                    "followup_questions": {
-                        "type": "array",
-                        "description": "List of follow-up questions",
-                        "items": {
-                            "type": "object",
-                            "properties": {
-                                "id": {"type": "string"},
-                                "label": {"type": "string"},
-                                "type": {"type": "string"}
-                            }
-                        }
-                    },
-                    "patient_info": {
-                        "type": "object",
-                        "description": "Patient information (name, age, gender, allergies, medications)"
-                    },
-                    "language_code": {
-                        "type": "string",
-                        "description": "Language code (en, hi, kn)"
-                    }
-                },
-                "required": ["session_id", "created_at", "initial_input_text", "ai_summary", "followup_questions", "patient_info", "language_code"]
+                    "id": {"type": "string"},
+                    "label": {"type": "string"},
+                    "type": {"type": "string"}
+                }
             }
-        ),
-        Tool(
-            name="update_prep_session",
-            description="Update a prep session with follow-up answers, final HTML output, and optional PDF URL",
-            inputSchema={
+        },
+        "patient_info": {
+            "type": "object",
+            "description": "Patient information (name, age, gender, allergies, medications)"
+        },
+        "language_code": {
+            "type": "string",
+            "description": "Language code (en, hi, kn)"
+        }
+    },
+    "required": ["session_id", "created_at", "initial_input_text", "ai_summary", "followup_questions", "patient_info", "language_code"]
+}
+
+UPDATE_SESSION_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "session_id": {
+            "type": "string",
+            "description": "Session ID to update"
+        },
+        "answers": {
+            "type": "array",
+            "description": "List of answers to follow-up questions",
+            "items": {
                 "type": "object",
                 "properties": {
-                    "session_id": {
-                        "type": "string",
-                        "description": "Session ID to update"
-                    },
-                    "answers": {
-                        "type": "array",
-                        "description": "List of answers to follow-up questions",
-                        "items": {
-                            "type": "object",
-                            "properties": {
-                                "id": {"type": "string"},
-                                "answer": {"type": "string"}
-                            }
-                        }
-                    },
-                    "final_output_html": {
-                        "type": "string",
-                        "description": "Final prep sheet HTML"
-                    },
-                    "pdf_url": {
-                        "type": "string",
-                        "description": "Optional GCS URL for generated PDF"
-                    }
-                },
-                "required": ["session_id", "answers", "final_output_html"]
+                    "id": {"type": "string"},
+                    "answer": {"type": "string"}
+                }
             }
-        )
-    ]
+        },
+        "final_output_html": {
+            "type": "string",
+            "description": "Final prep sheet HTML"
+        },
+        "pdf_url": {
+            "type": "string",
+            "description": "Optional GCS URL for generated PDF"
+        },
+        "append": {
+            "type": "boolean",
+            "description": "Append the answers to the stored ones instead of replacing them"
+        }
+    },
+    "required": ["session_id", "answers", "final_output_html"]
+}
+
+# Create and finalize in one write: the create fields plus the update fields
+CREATE_AND_FINALIZE_SCHEMA = {
+    "type": "object",
+    "properties": {
+        **{key: value for key, value in UPDATE_SESSION_SCHEMA["properties"].items() if key != "append"},
+        **CREATE_SESSION_SCHEMA["properties"]
+    },
+    "required": CREATE_SESSION_SCHEMA["required"] + ["answers", "final_output_html"]
+}
+
+BULK_CREATE_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "sessions": {
+            "type": "array",
+            "description": "Sessions to create, each with the create_prep_session fields",
+            "items": CREATE_SESSION_SCHEMA
+        }
+    },
+    "required": ["sessions"]
+}
+
+
+# Tool descriptors are immutable, so build the list once and hand out the same object
+_TOOLS = [
+    Tool(
+        name="create_prep_session",
+        description="Create a new prep session document in Firestore with initial patient info, symptom summary, and follow-up questions",
+        inputSchema=CREATE_SESSION_SCHEMA
+    ),
+    Tool(
+        name="update_prep_session",
+        description="Update a prep session with follow-up answers, final HTML output, and optional PDF URL",
+        inputSchema=UPDATE_SESSION_SCHEMA
+    ),
+    Tool(
+        name="create_and_finalize_prep_session",
+        description="Create a prep session that already has its answers and final output, in a single write",
+        inputSchema=CREATE_AND_FINALIZE_SCHEMA
+    ),
+    Tool(
+        name="bulk_create_prep_sessions",
+        description="Create many prep sessions using batched commits (e.g. for imports or seeding)",
+        inputSchema=BULK_CREATE_SCHEMA
+    )
+]
+
+
+@mcp_server.list_tools()
+async def list_tools() -> list[Tool]:
+    """List available Firestore tools."""
+    return _TOOLS
+
+
+_ERR_NO_DB = [TextContent(
+    type="text",
+    text=orjson.dumps({
+        "success": False,
+        "error": "Firestore client not initialized"
+    }).decode()
+)]
 
 
 @mcp_server.call_tool()
@@ -118,82 +212,109 @@ async def call_tool(name: str, arguments: dict[str, Any]) -> list[TextContent]:
     """Execute Firestore operations based on tool name."""
     
     if db is None:
-        return [TextContent(
-            type="text",
-            text=json.dumps({
-                "success": False,
-                "error": "Firestore client not initialized"
-            })
-        )]
+        return _ERR_NO_DB
     
     try:
         if name == "create_prep_session":
             session_id = arguments["session_id"]
-            doc_data = {
-                "id": session_id,
-                "created_at": arguments["created_at"],
-                "initial_input_text": arguments["initial_input_text"],
-                "ai_summary": arguments["ai_summary"],
-                "followup_data": {
-                    "questions": arguments["followup_questions"],
-                    "answers": []
-                },
-                "patient_info": arguments["patient_info"],
-                "language_code": arguments["language_code"],
-                "consentToStore": True
-            }
+            doc_data = _session_document(arguments)
             
             db.collection("prep_sessions").document(session_id).set(doc_data)
-            logger.info(f"Created session {session_id}")
+            logger.info("Created session %s", session_id)
             
             return [TextContent(
                 type="text",
-                text=json.dumps({
+                text=orjson.dumps({
                     "success": True,
                     "session_id": session_id,
                     "message": "Session created successfully"
-                })
+                }).decode()
             )]
         
         elif name == "update_prep_session":
             session_id = arguments["session_id"]
+            answers = arguments["answers"]
             update_data = {
-                "followup_data.answers": arguments["answers"],
-                "final_output_html": arguments["final_output_html"]
+                "final_output_html_zstd": compress_html(arguments["final_output_html"]),
+                "final_output_html": firestore.DELETE_FIELD,
+                "schema_version": SCHEMA_VERSION,
+                "last_updated": firestore.SERVER_TIMESTAMP
             }
+            if arguments.get("append"):
+                # Server-side transform: one write, no read. ArrayUnion skips duplicates, so
+                # the stored count can't be kept exact here; drop it and derive it on read
+                update_data["followup_data.answers"] = firestore.ArrayUnion(answers)
+                update_data["num_answers"] = firestore.DELETE_FIELD
+            else:
+                update_data["followup_data.answers"] = answers
+                update_data["num_answers"] = len(answers)
             
             if "pdf_url" in arguments and arguments["pdf_url"]:
                 update_data["pdf_url"] = arguments["pdf_url"]
             
             db.collection("prep_sessions").document(session_id).update(update_data)
-            logger.info(f"Updated session {session_id}")
+            logger.info("Updated session %s", session_id)
             
             return [TextContent(
                 type="text",
-                text=json.dumps({
+                text=orjson.dumps({
                     "success": True,
                     "session_id": session_id,
                     "message": "Session updated successfully"
-                })
+                }).decode()
+            )]
+        
+        elif name == "create_and_finalize_prep_session":
+            # Create and finalize in one commit instead of two round trips
+            session_id = arguments["session_id"]
+            write_session_and_answers(
+                session_id,
+                _session_document(arguments),
+                answers=arguments["answers"],
+                final_html=arguments["final_output_html"],
+                pdf_url=arguments.get("pdf_url") or None
+            )
+            logger.info("Created and finalized session %s", session_id)
+            
+            return [TextContent(
+                type="text",
+                text=orjson.dumps({
+                    "success": True,
+                    "session_id": session_id,
+                    "message": "Session created and finalized successfully"
+                }).decode()
+            )]
+        
+        elif name == "bulk_create_prep_sessions":
+            count = _bulk_create(arguments["sessions"])
+            logger.info("Created %s sessions", count)
+            
+            return [TextContent(
+                type="text",
+                text=orjson.dumps({
+                    "success": True,
+                    "count": count,
+                    "message": "Sessions created successfully"
+                }).decode()
             )]
         
         else:
             return [TextContent(
                 type="text",
-                text=json.dumps({
+                text=orjson.dumps({
                     "success": False,
                     "error": f"Unknown tool: {name}"
-                })
+                }).decode()
             )]
     
     except Exception as e:
-        logger.error(f"Error executing tool {name}: {e}")
+        logger.error("Error executing tool %s: %s", name, e)
         return [TextContent(
             type="text",
-            text=json.dumps({
+            text=orjson.dumps({
                 "success": False,
                 "error": str(e)
-            })
+            }).decode()
         )]
 
 
@@ -7,10 +7,81 @@ Gemini API calls before deploying.
 
 from __future__ import annotations
 
+import copy
+import hashlib
 import random
+from collections import OrderedDict
+from typing import Any, AsyncIterator
 
+import orjson
 
-def call_gemini(prompt: str, mode: str = "suggest") -> dict:
+# Responses are requested as JSON so callers can json.loads them in one pass
+# instead of scanning free text for section markers.
+DEFAULT_GENERATION_CONFIG = {"response_mime_type": "application/json"}
+
+# Exact-match response cache keyed by sha256(mode + prompt). Only deterministic
+# (temperature == 0) calls are cached, since sampled outputs should vary.
+CACHE_SIZE = 4096
+_RESPONSE_CACHE: OrderedDict[str, dict] = OrderedDict()
+
+
+def _cache_put(key: str, response: dict) -> None:
+    _RESPONSE_CACHE[key] = response
+    if len(_RESPONSE_CACHE) > CACHE_SIZE:
+        _RESPONSE_CACHE.popitem(last=False)
+
+
+def call_gemini(
+    prompt: str, mode: str = "suggest", generation_config: dict[str, Any] | None = None
+) -> dict:
+    """Call Gemini, reusing cached responses for repeated deterministic prompts.
+
+    ``generation_config`` is forwarded to the model; it defaults to JSON mode.
+    """
+    generation_config = generation_config or DEFAULT_GENERATION_CONFIG
+    if generation_config.get("temperature") != 0:
+        return _call_model(prompt, mode, generation_config)
+
+    key = hashlib.sha256(f"{mode}\0{prompt}".encode("utf-8")).hexdigest()
+    if key in _RESPONSE_CACHE:
+        _RESPONSE_CACHE.move_to_end(key)
+    else:
+        _cache_put(key, _call_model(prompt, mode, generation_config))
+    # Callers may mutate the result; keep the cached copy pristine
+    return copy.deepcopy(_RESPONSE_CACHE[key])
+
+
+async def stream_gemini(
+    prompt: str, mode: str = "suggest", generation_config: dict[str, Any] | None = None
+) -> AsyncIterator[str]:
+    """Stream the JSON response text from Gemini as it is generated.
+
+    Yields text chunks whose concatenation is the same JSON object ``call_gemini``
+    returns, so callers can forward them (e.g. as SSE) before the response completes.
+    Cached responses are replayed as a single chunk.
+    """
+    generation_config = generation_config or DEFAULT_GENERATION_CONFIG
+    cacheable = generation_config.get("temperature") == 0
+    key = hashlib.sha256(f"{mode}\0{prompt}".encode("utf-8")).hexdigest()
+    if cacheable and key in _RESPONSE_CACHE:
+        _RESPONSE_CACHE.move_to_end(key)
+        yield orjson.dumps(_RESPONSE_CACHE[key]).decode()
+        return
+
+    # Mock implementation: emit the mocked response in a few pieces
+    text = orjson.dumps(_call_model(prompt, mode, generation_config)).decode()
+    chunk_size = max(1, len(text) // 4)
+    chunks = []
+    for start in range(0, len(text), chunk_size):
+        chunks.append(text[start:start + chunk_size])
+        yield chunks[-1]
+
+    # Fill the cache on a miss too, so call_gemini and later streams can reuse it
+    if cacheable:
+        _cache_put(key, orjson.loads("".join(chunks)))
+
+
+def _call_model(prompt: str, mode: str, generation_config: dict[str, Any]) -> dict:
     """Call Gemini (mock implementation)."""
     if mode == "suggest":
         return {
@@ -50,11 +121,19 @@ def call_gemini(prompt: str, mode: str = "suggest") -> dict:
     return {"content": "mock response", "token": random.randint(1, 1000)}
 
 
-# TODO: Replace with real Gemini call, e.g.:
+# TODO: Replace with real Gemini calls, e.g.:
 # from vertexai.generative_models import GenerativeModel
-# def call_gemini(prompt: str, mode: str = "suggest") -> dict:
+# def call_gemini(prompt: str, mode: str = "suggest", generation_config=None) -> dict:
 #     model = GenerativeModel("gemini-1.5-flash")
-#     response = model.generate_content(prompt)
-#     return parse_response(response.text)
-
-
+#     response = model.generate_content(
+#         prompt, generation_config=generation_config or DEFAULT_GENERATION_CONFIG
+#     )
+#     return json.loads(response.text)
+#
+# async def stream_gemini(prompt: str, mode: str = "suggest", generation_config=None):
+#     model = GenerativeModel("gemini-1.5-flash")
+#     stream = await model.generate_content_async(
+#         prompt, generation_config=generation_config or DEFAULT_GENERATION_CONFIG, stream=True
+#     )
+#     async for chunk in stream:
+#         yield chunk.text
@@ -2,11 +2,28 @@
 
 from __future__ import annotations
 
-import pdfkit  # type: ignore
+import functools
+import logging
+
+from weasyprint import HTML  # type: ignore
+from weasyprint.text.fonts import FontConfiguration  # type: ignore
+
+
+@functools.lru_cache(maxsize=1)
+def _font_config() -> FontConfiguration:
+    """Build the font configuration once instead of on every conversion."""
+    return FontConfiguration()
 
 
 def html_to_pdf_bytes(html: str) -> bytes:
     """Convert HTML string to PDF bytes."""
-    return pdfkit.from_string(html, False)
+    return HTML(string=html).write_pdf(font_config=_font_config())
 
 
+def warmup() -> None:
+    """Load WeasyPrint's fonts and layout machinery so the first real render is fast."""
+    # Never raise: a failing pool initializer would break the pool for every render
+    try:
+        html_to_pdf_bytes("<p></p>")
+    except Exception as exc:  # pragma: no cover
+        logging.warning("PDF warmup failed: %s", exc)
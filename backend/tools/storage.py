@@ -2,21 +2,76 @@
 
 from __future__ import annotations
 
+import io
+import threading
+from datetime import timedelta
+
 try:
+    import google.auth  # type: ignore
+    from google.auth import credentials as auth_credentials  # type: ignore
+    from google.auth.transport import requests as auth_requests  # type: ignore
     from google.cloud import storage  # type: ignore
 except Exception:  # pragma: no cover
     storage = None
 
+_CLIENT = None
+_CLIENT_LOCK = threading.Lock()
+_SIGNING_CREDENTIALS = None
+_SIGNING_LOCK = threading.Lock()
+
+# How long links returned by signed_url stay valid
+SIGNED_URL_EXPIRATION = timedelta(hours=1)
+
+# Uploads larger than this go up as a resumable upload in chunks of this size
+UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+
+
+def _client():
+    global _CLIENT
+    if _CLIENT is None:
+        with _CLIENT_LOCK:
+            if _CLIENT is None:
+                if storage is None:
+                    raise RuntimeError("google-cloud-storage is not installed.")
+                _CLIENT = storage.Client()
+    return _CLIENT
+
+
+def _signing_kwargs() -> dict:
+    """Extra generate_signed_url arguments for credentials without a private key.
+    
+    Service account keys sign locally. Metadata-server credentials (Cloud Run, GCE)
+    have no key, so those URLs are signed through the IAM signBlob API using the
+    account's access token; the account needs Service Account Token Creator on itself.
+    """
+    global _SIGNING_CREDENTIALS
+    with _SIGNING_LOCK:
+        if _SIGNING_CREDENTIALS is None:
+            _SIGNING_CREDENTIALS, _ = google.auth.default(
+                scopes=["https://www.googleapis.com/auth/cloud-platform"]
+            )
+        credentials = _SIGNING_CREDENTIALS
+        if isinstance(credentials, auth_credentials.Signing):
+            return {}
+        if not credentials.valid:
+            credentials.refresh(auth_requests.Request())
+        return {"service_account_email": credentials.service_account_email, "access_token": credentials.token}
+
 
-def upload_pdf(bucket_name: str, blob_name: str, data: bytes) -> str | None:
-    """Upload PDF bytes to GCS and return the public URL."""
-    if storage is None:
-        raise RuntimeError("google-cloud-storage is not installed.")
-    client = storage.Client()
-    bucket = client.bucket(bucket_name)
-    blob = bucket.blob(blob_name)
-    blob.upload_from_string(data, content_type="application/pdf")
-    blob.make_public()
-    return blob.public_url
+def upload_pdf(bucket_name: str, blob_name: str, data: bytes) -> str:
+    """Upload PDF bytes to GCS and return the object's gs:// path."""
+    bucket = _client().bucket(bucket_name)
+    blob = bucket.blob(blob_name, chunk_size=UPLOAD_CHUNK_SIZE)
+    blob.upload_from_file(io.BytesIO(data), content_type="application/pdf", size=len(data))
+    return f"gs://{bucket_name}/{blob_name}"
 
 
+def signed_url(pdf_path: str) -> str:
+    """Return a time-limited signed URL for a gs:// path returned by upload_pdf.
+    
+    Sign when the link is handed out rather than storing it, since it expires.
+    """
+    blob = storage.Blob.from_string(pdf_path, client=_client())
+    return blob.generate_signed_url(
+        version="v4", expiration=SIGNED_URL_EXPIRATION, method="GET", **_signing_kwargs()
+    )
@@ -1,30 +1,118 @@
-import base64
+import hashlib
 import os
+import uuid
+from dataclasses import asdict, dataclass
+from pathlib import Path
 
+import orjson
 import requests
 import streamlit as st
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 API_BASE_URL = os.environ.get("BACKEND_URL", "http://localhost:8080")
 
 
-def post_json(path: str, payload: dict):
-    resp = requests.post(f"{API_BASE_URL}{path}", json=payload, timeout=60)
+
+@dataclass(slots=True, frozen=True)
+class PatientInfo:
+    name: str
+    age: int
+    gender: str
+    allergies: str
+    medications: str
+
+
+@dataclass(slots=True, frozen=True)
+class Question:
+    id: str
+    label: str
+    type: str
+    options: tuple[str, ...]
+    min: int
+    max: int
+
+
+def parse_questions(raw_questions: list[dict]) -> tuple[Question, ...]:
+    # Normalize the /suggest questions once, so reruns of step 3 only read attributes
+    return tuple(
+        Question(
+            id=q.get("id") or q.get("label") or f"q_{i}",
+            label=q.get("label", "Question"),
+            type=q.get("type", "text"),
+            options=tuple(q.get("options") or ["Yes", "No"]),
+            min=q.get("min", 1),
+            max=q.get("max", 10),
+        )
+        for i, q in enumerate(raw_questions)
+    )
+
+
+@st.cache_resource
+def _session() -> requests.Session:
+    # Pooled keep-alive connections to the backend, shared across reruns and users;
+    # urllib3 only retries a POST when the connection failed before the request was sent
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=4,
+        pool_maxsize=16,
+        max_retries=Retry(total=2, backoff_factor=0.3, status_forcelist=[502, 503, 504]),
+    )
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+@st.cache_data(ttl=3600, max_entries=256, show_spinner=False)
+def _post_cached(path: str, payload_digest: str, _payload_json: bytes):
+    # Keyed on (path, payload_digest) only; Streamlit doesn't hash underscore args
+    resp = _session().post(
+        f"{API_BASE_URL}{path}",
+        data=_payload_json,
+        headers={"Content-Type": "application/json"},
+        timeout=60,
+    )
+    resp.raise_for_status()
+    return orjson.loads(resp.content)
+
+
+@st.cache_data(ttl=600, max_entries=64, show_spinner=False)
+def fetch_pdf(session_id: str, prep_sheet_text: str) -> bytes:
+    # Fetched once per generated sheet, then served from the cache on reruns;
+    # prep_sheet_text is only part of the key, so regenerating refetches
+    resp = _session().get(f"{API_BASE_URL}/sessions/{session_id}/pdf", timeout=60)
     resp.raise_for_status()
-    return resp.json()
+    return resp.content
+
+
+def post_json(path: str, payload: dict):
+    # Identical payloads (e.g. a double click or a retry after navigating back) reuse
+    # the cached response; payloads carry the session id, so users never share entries.
+    # The key is a digest of the canonical payload, so patient details never form it.
+    payload_json = orjson.dumps(payload, option=orjson.OPT_SORT_KEYS)
+    payload_digest = hashlib.blake2b(payload_json, digest_size=16).hexdigest()
+    return _post_cached(path, payload_digest, payload_json)
+
+
+@st.cache_data
+def css_block() -> str:
+    # Read and wrap the stylesheet once per process instead of on every rerun
+    return f"<style>\n{(Path(__file__).parent / 'style.css').read_text()}</style>"
 
 
 def init_state():
     defaults = {
         "step": 1,
-        "patient_info": {},
+        "patient_info": None,
         "consent": False,
         "session_id": "",
         "summary": "",
-        "questions": [],
+        "questions": (),
         "answers": {},
         "prep_sheet_html": "",
         "prep_sheet_text": "",
-        "pdf_base64": "",
+        "pdf_url": "",
+        "pdf_requested": False,
     }
     for key, value in defaults.items():
         if key not in st.session_state:
@@ -44,54 +132,7 @@ def main():
     )
 
     # Custom CSS for a more attractive and colorful UI
-    st.markdown("""
-    <style>
-    .stApp {
-        background-color: #e6f7ff; /* Light blue background */
-    }
-    .stTextInput>div>div>input,
-    .stTextArea>div>div>textarea,
-    .stSelectbox>div>div:first-child {
-        background-color: #ffffff;
-        border: 1px solid #87ceeb; /* Sky blue border */
-        border-radius: 5px;
-        color: #333333;
-        padding: 0.5rem;
-    }
-    .stButton>button {
-        background-color: #4CAF50; /* Green */
-        color: white;
-        border-radius: 8px;
-        padding: 10px 20px;
-        border: none;
-        cursor: pointer;
-        font-size: 16px;
-        transition: background-color 0.3s;
-    }
-    .stButton>button:hover {
-        background-color: #45a049; /* Darker green on hover */
-    }
-    h1, h2, h3, h4, h5, h6 {
-        color: #0056b3; /* Darker blue for headers */
-        font-family: 'Segoe UI', sans-serif;
-    }
-    .stAlert {
-        border-radius: 8px;
-        background-color: #fff3cd; /* Light yellow for warnings */
-        color: #856404;
-        border-color: #ffeeba;
-    }
-    .stMarkdown p {
-        color: #333333;
-    }
-    .css-1d391kg {
-        padding-top: 3.5rem;
-        padding-right: 1rem;
-        padding-bottom: 3.5rem;
-        padding-left: 1rem;
-    }
-    </style>
-    """, unsafe_allow_html=True)
+    st.markdown(css_block(), unsafe_allow_html=True)
 
     st.container()
     col1, col2 = st.columns([1, 4])
@@ -103,14 +144,7 @@ def main():
 
     init_state()
 
-    if st.session_state.step == 1:
-        step_patient_info()
-    elif st.session_state.step == 2:
-        step_symptom_input()
-    elif st.session_state.step == 3:
-        step_followups()
-    elif st.session_state.step == 4:
-        step_prep_sheet()
+    STEPS[st.session_state.step]()
 
     st.write("---")
     st.info(
@@ -119,6 +153,19 @@ def main():
     )
 
 
+def validate_patient_info(name: str, allergies: str, medications: str, consent: bool) -> list:
+    errors = []
+    if not name.strip():
+        errors.append("Full Name is required.")
+    if not allergies.strip():
+        errors.append("Allergies is required (enter 'None' if none).")
+    if not medications.strip():
+        errors.append("Current medications is required (enter 'None' if none).")
+    if not consent:
+        errors.append("Consent must be granted to continue.")
+    return errors
+
+
 def step_patient_info():
     st.header("1. Patient information & consent 📝")
     with st.expander("Enter your details here", expanded=True):
@@ -147,16 +194,19 @@ def step_patient_info():
             submitted = st.form_submit_button("Continue ▶️")
 
     if submitted:
-        if not (name and allergies and medications and consent):
-            st.error("All required fields must be filled and consent must be granted.")
+        # Report every missing field at once rather than one per submit
+        errors = validate_patient_info(name, allergies, medications, consent)
+        for error in errors:
+            st.error(error)
+        if errors:
             return
-        st.session_state.patient_info = {
-            "name": name.strip(),
-            "age": int(age),
-            "gender": gender,
-            "allergies": allergies.strip(),
-            "medications": medications.strip(),
-        }
+        st.session_state.patient_info = PatientInfo(
+            name=name.strip(),
+            age=age,  # number_input with int bounds/step already returns an int
+            gender=gender,
+            allergies=allergies.strip(),
+            medications=medications.strip(),
+        )
         st.session_state.consent = consent
         
         # Optional: Display a success message for patient info
@@ -168,17 +218,23 @@ def step_patient_info():
 def step_symptom_input():
     st.header("2. Describe your symptoms 🗣️")
     with st.expander("Tell us what you're experiencing", expanded=True):
-        symptom = st.text_area(
-            "Explain what you're experiencing in one or two sentences.",
-            height=120,
-        )
-        language = st.selectbox("Language", ["en", "hi", "kn"], index=0)
-    if st.button("Generate summary & questions ✨"):
+        # A form so typing and picking a language don't each rerun the script
+        with st.form("symptom_form"):
+            symptom = st.text_area(
+                "Explain what you're experiencing in one or two sentences.",
+                height=120,
+            )
+            language = st.selectbox("Language", ["en", "hi", "kn"], index=0)
+            submitted = st.form_submit_button("Generate summary & questions ✨")
+    if submitted:
         if not symptom.strip():
             st.error("Please provide a symptom description.")
             return
+        if not st.session_state.session_id:
+            st.session_state.session_id = str(uuid.uuid4())
         payload = {
-            "patient_info": st.session_state.patient_info,
+            "session_id": st.session_state.session_id,
+            "patient_info": asdict(st.session_state.patient_info),
             "symptom_description": symptom.strip(),
             "language": language,
             "consent": st.session_state.consent,
@@ -192,7 +248,7 @@ def step_symptom_input():
             return
         st.session_state.session_id = data["session_id"]
         st.session_state.summary = data["summary"]
-        st.session_state.questions = data.get("questions", [])
+        st.session_state.questions = parse_questions(data.get("questions", []))
         st.session_state.answers = {}
         st.session_state.language = language
         st.session_state.step = 3
@@ -202,86 +258,95 @@ def step_symptom_input():
 def step_followups():
     st.header("3. Review summary & answer quick questions 🧐")
     
-    st.subheader("Your Symptom Summary (editable)")
-    st.session_state.summary = st.text_area(
-        "Summary", value=st.session_state.summary, height=120
-    )
+    # The summary is part of the form too, so editing it doesn't rerun the script
+    with st.form("followup_form"):
+        st.subheader("Your Symptom Summary (editable)")
+        summary = st.text_area(
+            "Summary", value=st.session_state.summary, height=120
+        )
 
-    st.subheader("Clarifying questions")
-    with st.expander("Answer your doctor's follow-up questions", expanded=True):
-        with st.form("followup_form"):
+        st.subheader("Clarifying questions")
+        with st.expander("Answer your doctor's follow-up questions", expanded=True):
             answered_questions = {}
-            num_questions = len(st.session_state.questions)
+            question_fields = []  # (qid, label) in display order, built in the same pass
             cols_per_row = 2 # Number of columns for questions
 
             for i, question in enumerate(st.session_state.questions):
                 if i % cols_per_row == 0:
                     cols = st.columns(cols_per_row)
                 
-                qid = question.get("id") or question.get("label")
-                label = question.get("label", "Question")
-                qtype = question.get("type", "text")
+                qid, label = question.id, question.label
+                question_fields.append((qid, label))
                 key = f"answer_{qid}"
+                # Seed widget state once from any saved answer instead of
+                # passing a default value on every rerun
+                prior = st.session_state.answers.get(qid)
 
                 with cols[i % cols_per_row]:
-                    if qtype == "choice":
-                        options = question.get("options") or ["Yes", "No"]
-                        answered_questions[qid] = st.selectbox(
-                            label, options, key=key, index=0
+                    if question.type == "choice":
+                        options = question.options
+                        st.session_state.setdefault(key, prior if prior in options else options[0])
+                        answered_questions[qid] = st.selectbox(label, options, key=key)
+                    elif question.type == "scale":
+                        min_val, max_val = question.min, question.max
+                        st.session_state.setdefault(
+                            key, prior if prior is not None else (min_val + max_val) // 2
                         )
-                    elif qtype == "scale":
-                        min_val = question.get("min", 1)
-                        max_val = question.get("max", 10)
                         answered_questions[qid] = st.slider(
                             label,
                             min_value=min_val,
                             max_value=max_val,
-                            value=(min_val + max_val) // 2,
                             key=key,
                         )
                     else:
-                        answered_questions[qid] = st.text_input(
-                            label, key=key, value=st.session_state.answers.get(qid, "")
-                        )
+                        st.session_state.setdefault(key, prior or "")
+                        answered_questions[qid] = st.text_input(label, key=key)
             
             generate_button = st.form_submit_button("Generate prep sheet 📄")
 
             if generate_button:
+                st.session_state.summary = summary
                 st.session_state.answers = answered_questions
                 st.success("Answers saved. Generating your prep sheet...")
 
                 # Prepare answers in the format expected by the backend
-                formatted_answers = []
-                for q in st.session_state.questions:
-                    qid = q.get("id") or q.get("label") or f"q_{st.session_state.questions.index(q)}"
-                    label = q.get("label", "Question")
-                    answer = answered_questions.get(qid, "")
-                    # Ensure all required fields are present and non-empty
-                    if qid and label:
-                        formatted_answers.append({
-                            "id": str(qid),
-                            "label": str(label),
-                            "answer": str(answer) if answer else ""  # Convert to string, allow empty
-                        })
-
+                formatted_answers = [
+                    {
+                        "id": str(qid),
+                        "label": str(label),
+                        "answer": str(answered_questions.get(qid) or "")  # Convert to string, allow empty
+                    }
+                    for qid, label in question_fields
+                    if label  # Ensure all required fields are present and non-empty
+                ]
+
+                # The backend kept patient_info and language from /suggest, so only
+                # send what this step changes (the summary is editable here)
                 payload = {
                     "session_id": st.session_state.session_id,
-                    "patient_info": st.session_state.patient_info,
                     "summary": st.session_state.summary,
                     "answers": formatted_answers, # Use the formatted answers
-                    "language": st.session_state.get("language", "en"),  # Default to "en" if not set
                     "consent": st.session_state.consent,
                 }
                 try:
                     with st.spinner("Finalizing prep sheet..."):
-                        data = post_json("/generate", payload)
+                        try:
+                            data = post_json("/generate", payload)
+                        except requests.HTTPError as exc:
+                            if exc.response is None or exc.response.status_code != 409:
+                                raise
+                            # Backend lost the session context (restart, other instance): send it all
+                            payload["patient_info"] = asdict(st.session_state.patient_info)
+                            payload["language"] = st.session_state.get("language", "en")  # Default to "en" if not set
+                            data = post_json("/generate", payload)
                     st.success("Prep sheet generated successfully!")
                 except Exception as exc:
                     st.error(f"Backend error: {exc}")
                     return
                 st.session_state.prep_sheet_html = data.get("prep_sheet_html", "")
                 st.session_state.prep_sheet_text = data.get("prep_sheet_text", "")
-                st.session_state.pdf_base64 = data.get("pdf_base64", "")
+                st.session_state.pdf_url = data.get("pdf_url") or ""
+                st.session_state.pdf_requested = False
                 st.session_state.step = 4
                 st.rerun()
 
@@ -308,25 +373,59 @@ def step_prep_sheet():
         )
 
     if st.button("Start over 🔄"):
-        for key in list(st.session_state.keys()):
-            del st.session_state[key]
+        # main() calls init_state() on the rerun, which restores the defaults
+        st.session_state.clear()
         st.rerun()
     
     st.write("---")
     
     # Download PDF button at the end
-    if st.session_state.pdf_base64:
-        pdf_bytes = base64.b64decode(st.session_state.pdf_base64)
-        st.download_button(
+    pdf_download()
+
+
+@st.fragment
+def pdf_download():
+    # Runs as a fragment so clicking download reruns only this block,
+    # not the prep sheet preview above it
+    if st.session_state.pdf_url:
+        st.link_button(
             "📥 Download PDF",
-            data=pdf_bytes,
-            file_name=f"prep_{st.session_state.session_id}.pdf",
-            mime="application/pdf",
+            st.session_state.pdf_url,
             use_container_width=True,
         )
-    else:
+        return
+    # Only pull the PDF bytes from the backend once the user asks for them
+    if not st.session_state.pdf_requested:
+        if not st.button("📄 Prepare PDF", use_container_width=True):
+            return
+        st.session_state.pdf_requested = True
+    try:
+        pdf_bytes = fetch_pdf(st.session_state.session_id, st.session_state.prep_sheet_text)
+    except requests.RequestException as exc:
+        if isinstance(exc, requests.HTTPError) and exc.response is not None and exc.response.status_code == 404:
+            # The backend only keeps rendered PDFs briefly
+            st.info("This PDF is no longer available. Please generate the prep sheet again.")
+            return
         st.info("PDF generation is in progress or unavailable. Please try again.")
+        # Clicking reruns this fragment, which fetches again (failures aren't cached)
+        st.button("🔁 Retry", use_container_width=True)
+        return
+    st.download_button(
+        "📥 Download PDF",
+        data=pdf_bytes,
+        file_name=f"prep_{st.session_state.session_id}.pdf",
+        mime="application/pdf",
+        use_container_width=True,
+    )
+
 
+# Wizard steps, dispatched by st.session_state.step
+STEPS = {
+    1: step_patient_info,
+    2: step_symptom_input,
+    3: step_followups,
+    4: step_prep_sheet,
+}
 
 if __name__ == "__main__":
     main()